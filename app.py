@@ -1,65 +1,16 @@
 # app.py
+# housing_core first: it pins the BLAS/OpenMP thread counts before numpy loads
+from housing_core import ensure_model, load_assets
 import streamlit as st
 import pandas as pd
-from joblib import load
-import json
-from pathlib import Path
 
 st.set_page_config(page_title="🏠 House Price (€/m²) Predictor", layout="centered")
 
-MODEL_PATH = Path("rf_price_per_m2.joblib")
-FEATURES_PATH = Path("rf_price_features.json")
-CHOICES_PATH = Path("choices.json")
-GDRIVE_FILE_ID = "1vPIL6uwvfknWttb4CzS8WDogmUI2i0nf"  # your Drive file id
-
-def ensure_model():
-    if MODEL_PATH.exists():
-        return
-    st.warning("Downloading model file (first run only)…")
-    try:
-        import gdown
-        gdown.download(id=GDRIVE_FILE_ID, output=str(MODEL_PATH), quiet=False)
-        if not MODEL_PATH.exists() or MODEL_PATH.stat().st_size < 10_000_000:
-            raise RuntimeError("Downloaded file looks too small or missing.")
-    except Exception as e:
-        st.error(f"Model download failed: {e}")
-        st.stop()
-
-def read_json_resilient(path: Path, default):
-    if not path.exists():
-        return default
-    for enc in ("utf-8", "latin-1"):
-        try:
-            with open(path, "r", encoding=enc) as f:
-                return json.load(f)
-        except Exception:
-            continue
-    return default
-
 ensure_model()
 
-@st.cache_resource
-def load_assets():
-    features = read_json_resilient(FEATURES_PATH, None)
-    if not features:
-        st.error(f"Missing or invalid {FEATURES_PATH.name}."); st.stop()
-    choices = read_json_resilient(CHOICES_PATH, {"Town": [], "Type": []})
-    model = load(MODEL_PATH)
-
-    # patch for sklearn 1.3 -> 1.7 (monotonic_cst)
-    from sklearn.tree import DecisionTreeRegressor
-    if hasattr(model, "steps"):
-        last = model.steps[-1][1]
-        if hasattr(last, "estimators_"):
-            for est in last.estimators_:
-                if isinstance(est, DecisionTreeRegressor) and not hasattr(est, "monotonic_cst"):
-                    est.monotonic_cst = None
-    return model, features, choices
-
-model, features, choices = load_assets()
-
-cat_cols = ["Town", "Type"]
-num_cols = [c for c in features if c not in cat_cols]
+(model, features, choices, cat_cols, num_cols,
+ known_towns, known_types, predict_fn) = load_assets()
+st.session_state.setdefault("town_tuple", choices["Town"])
 
 st.title("🏠 House Price (€/m²) Predictor")
 
@@ -71,14 +22,14 @@ with st.form("inputs"):
     with c1:
         inputs["Town"] = st.selectbox(
             "Town (type to search)",
-            options=choices.get("Town", []), index=None, placeholder="Start typing…"
+            options=st.session_state["town_tuple"], index=None, placeholder="Start typing…"
         ) or ""
 
     # Type (searchable)
     with c2:
         inputs["Type"] = st.selectbox(
             "Type (type to search)",
-            options=choices.get("Type", []), index=None, placeholder="Start typing…"
+            options=choices["Type"], index=None, placeholder="Start typing…"
         ) or ""
 
     # integer defaults
@@ -151,7 +102,21 @@ with st.form("inputs"):
 
 st.caption("ℹ️ Travel times were computed assuming departure at **08:00** on a **weekday**.")
 
-if submitted:
+# result block as a fragment: it holds no widgets today, so it never reruns on
+# its own; any widget added here later would rerun only this block
+@st.fragment
+def show_prediction(inputs):
+    # nothing to predict: skip the model call entirely
+    if not inputs["Town"] or not inputs["Type"]:
+        st.info("Pick a Town and a Type."); return
+    # unseen categories: stop here instead of going through the encoder's unknown path
+    if known_towns and inputs["Town"] not in known_towns:
+        st.warning(f"Unknown town: {inputs['Town']}. Pick one from the list."); return
+    if known_types and inputs["Type"] not in known_types:
+        st.warning(f"Unknown type: {inputs['Type']}. Pick one from the list."); return
+    if int(inputs.get("TotalArea", 0) or 0) == 0:
+        st.info("Enter a Total Area > 0."); return
+
     # build row in training order
     row = {k: inputs.get(k, None) for k in features}
 
@@ -166,15 +131,14 @@ if submitted:
         except Exception:
             row[k] = 0.0
 
-    X = pd.DataFrame([row])
     try:
-        ppm2 = float(model.predict(X)[0])
+        ppm2 = predict_fn(row)
         total = ppm2 * float(inputs.get("TotalArea", 0) or 0)
         st.success(f"Estimated price: €{total:,.0f}  (≈ €{ppm2:,.0f} / m²)")
         with st.expander("Show input row"):
-            st.write(row)
+            st.dataframe(pd.DataFrame([row]))
     except Exception as e:
         st.error(f"Prediction failed: {e}")
 
-
-
+if submitted:
+    show_prediction(inputs)
@@ -0,0 +1,66 @@
+# convert.py -- one-off: compile the forest from rf_price_per_m2.joblib into
+# faster native predictors that housing_core.make_forest_predict picks up
+# when present
+#
+#   pip install skl2onnx onnxruntime treelite tl2cgen numba
+#   python convert.py
+#
+# Only the RandomForestRegressor is converted; housing_core encodes Town/Type
+# itself (see housing_core.compile_preprocessor), so every artifact takes the
+# already-encoded float32 row. Missing converter packages just skip that artifact.
+from pathlib import Path
+
+from joblib import load
+
+from housing_core import MODEL_PATH, ONNX_PATH, TREELITE_LIB_PATH
+
+model = load(MODEL_PATH)
+forest = model.steps[-1][1] if hasattr(model, "steps") else model
+n_features = forest.n_features_in_
+
+# ONNX Runtime: whole ensemble as one TreeEnsembleRegressor kernel
+try:
+    from skl2onnx import convert_sklearn
+    from skl2onnx.common.data_types import FloatTensorType
+except ImportError:
+    print("skl2onnx not installed; skipping ONNX export")
+else:
+    onx = convert_sklearn(
+        forest,
+        initial_types=[("input", FloatTensorType([None, n_features]))],
+        target_opset={"": 17, "ai.onnx.ml": 3},
+    )
+    ONNX_PATH.write_bytes(onx.SerializeToString())
+    print(f"Wrote {ONNX_PATH} ({n_features} inputs, {len(forest.estimators_)} trees)")
+
+# Treelite/TL2cgen: trees compiled to C. quantize=1 turns float thresholds into
+# small integer bin indices, shrinking every node compare.
+try:
+    import tl2cgen
+    import treelite.sklearn
+except ImportError:
+    print("treelite/tl2cgen not installed; skipping native library")
+else:
+    tl_model = treelite.sklearn.import_model(forest)
+    tl2cgen.export_lib(
+        tl_model, toolchain="gcc", libpath=str(TREELITE_LIB_PATH),
+        params={"parallel_comp": 0, "quantize": 1},
+    )
+    print(f"Wrote {TREELITE_LIB_PATH}")
+
+# forest_native: forest_kernel.forest_predict compiled ahead of time, so app
+# workers import a ready extension instead of JIT-compiling it on cold start
+try:
+    from numba.pycc import CC
+except ImportError:
+    print("numba.pycc not available; skipping forest_native")
+else:
+    import forest_kernel
+    cc = CC("forest_native")
+    cc.output_dir = str(Path(__file__).resolve().parent)
+    cc.export(
+        "forest_predict",
+        "f8[:](f4[:, :], i4[:], i4[:], i4[:], f8[:], f8[:], u1[:], i4[:])",
+    )(forest_kernel.forest_predict)
+    cc.compile()
+    print(f"Wrote forest_native extension to {cc.output_dir}")
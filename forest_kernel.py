@@ -0,0 +1,50 @@
+# forest_kernel.py -- flat random-forest traversal for single-row predicts
+#
+# sklearn keeps each tree's node arrays in separate allocations; here every
+# tree's arrays are concatenated into one contiguous array per field (children
+# rebased to global node ids) plus a table of root offsets, and
+# forest_predict walks them. housing_core.make_forest_predict compiles it with
+# numba (or imports the forest_native build from convert.py).
+import numpy as np
+
+TREE_LEAF = -1
+
+def flatten_forest(forest):
+    trees = [est.tree_ for est in forest.estimators_]
+    roots = np.cumsum([0] + [t.node_count for t in trees[:-1]]).astype(np.int32)
+
+    def rebase(children, root):
+        return np.where(children == TREE_LEAF, TREE_LEAF, children + root)
+
+    left = np.concatenate([rebase(t.children_left, r) for t, r in zip(trees, roots)]).astype(np.int32)
+    right = np.concatenate([rebase(t.children_right, r) for t, r in zip(trees, roots)]).astype(np.int32)
+    feature = np.concatenate([t.feature for t in trees]).astype(np.int32)
+    # thresholds stay float64: sklearn compares the float32 input against them
+    threshold = np.concatenate([t.threshold for t in trees]).astype(np.float64)
+    value = np.concatenate([t.value[:, 0, 0] for t in trees]).astype(np.float64)
+    # sklearn >= 1.3 routes NaN per node (e.g. OrdinalEncoder unknown_value=nan);
+    # older trees have no such array and never saw NaN
+    missing_left = np.concatenate([
+        getattr(t, "missing_go_to_left", np.zeros(t.node_count, dtype=np.uint8)) for t in trees
+    ]).astype(np.uint8)
+    return left, right, feature, threshold, value, missing_left, roots
+
+def forest_predict(X, left, right, feature, threshold, value, missing_left, roots):
+    # X: (n, n_features) float32 -> (n,) mean of the tree outputs
+    n_trees = roots.shape[0]
+    out = np.empty(X.shape[0])
+    for i in range(X.shape[0]):
+        acc = 0.0
+        for t in range(n_trees):
+            node = roots[t]
+            while left[node] != TREE_LEAF:
+                x = X[i, feature[node]]
+                if x != x:  # NaN: follow the side sklearn learned for missing values
+                    node = left[node] if missing_left[node] else right[node]
+                elif x <= threshold[node]:
+                    node = left[node]
+                else:
+                    node = right[node]
+            acc += value[node]
+        out[i] = acc / n_trees
+    return out
@@ -0,0 +1,398 @@
+# housing_core.py -- model download, asset loading and prediction for app.py
+#
+# Kept out of app.py on purpose: Streamlit re-executes the app script on every
+# rerun, while an imported module is initialised once per process, so the
+# locks and caches below really are process-wide.
+import asyncio
+import gc
+import mmap
+import os
+import queue
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from functools import lru_cache
+
+# single-row predicts: thread pools cost more to spin up than they save.
+# Must be set before numpy/sklearn load BLAS/OpenMP (setdefault keeps any
+# value already exported in the deployment environment).
+for _var in ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS"):
+    os.environ.setdefault(_var, "1")
+
+import streamlit as st
+import numpy as np
+import pandas as pd
+from joblib import dump, load
+import json
+import orjson
+from pathlib import Path
+
+MODEL_PATH = Path("rf_price_per_m2.joblib")
+ONNX_PATH = Path("rf_price_per_m2.onnx")  # optional, built by convert.py
+TREELITE_LIB_PATH = Path("rf_price_per_m2.so")  # optional, built by convert.py
+FEATURES_PATH = Path("rf_price_features.json")
+CHOICES_PATH = Path("choices.json")
+GDRIVE_FILE_ID = "1vPIL6uwvfknWttb4CzS8WDogmUI2i0nf"  # your Drive file id
+GDRIVE_URL = f"https://drive.usercontent.google.com/download?id={GDRIVE_FILE_ID}&export=download&confirm=t"
+DOWNLOAD_PARTS = 8
+
+# concurrent first sessions must not each start their own download
+_model_lock = threading.Lock()
+
+async def fetch_ranged(url, path: Path, parts):
+    # Parallel Range GETs written straight into place with pwrite. Returns False
+    # (nothing written) when the server doesn't honour ranges.
+    import aiohttp
+    timeout = aiohttp.ClientTimeout(total=None, sock_read=60)
+    async with aiohttp.ClientSession(timeout=timeout) as session:
+        async with session.get(url, headers={"Range": "bytes=0-0"}) as r:
+            r.raise_for_status()
+            if r.status != 206 or "/" not in r.headers.get("Content-Range", ""):
+                return False
+            size = int(r.headers["Content-Range"].rsplit("/", 1)[1])
+
+        step = -(-size // parts)
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            os.ftruncate(fd, size)
+
+            async def fetch(start):
+                end = min(start + step, size) - 1
+                async with session.get(url, headers={"Range": f"bytes={start}-{end}"}) as r:
+                    if r.status != 206:
+                        raise RuntimeError(f"range {start}-{end}: HTTP {r.status}")
+                    pos = start
+                    async for chunk in r.content.iter_chunked(1 << 20):
+                        os.pwrite(fd, chunk, pos)
+                        pos += len(chunk)
+                if pos != end + 1:
+                    raise RuntimeError(f"range {start}-{end}: short read")
+
+            await asyncio.gather(*(fetch(start) for start in range(0, size, step)))
+        finally:
+            os.close(fd)
+    return True
+
+def download_model(dest: Path):
+    try:
+        if asyncio.run(fetch_ranged(GDRIVE_URL, dest, DOWNLOAD_PARTS)):
+            return
+    except Exception:
+        pass
+    dest.unlink(missing_ok=True)
+    # no range support (or the ranged fetch failed): single-stream gdown
+    import gdown
+    # resume=True picks up a partial file left by an interrupted cold start
+    gdown.download(id=GDRIVE_FILE_ID, output=str(dest), quiet=False, resume=True)
+
+def ensure_model():
+    if MODEL_PATH.exists():
+        return
+    with _model_lock:
+        if MODEL_PATH.exists():  # another session finished it while we waited
+            return
+        st.warning("Downloading model file (first run only)…")
+        part = MODEL_PATH.with_name(MODEL_PATH.name + ".part")
+        try:
+            download_model(part)
+            if not part.exists() or part.stat().st_size < 10_000_000:
+                raise RuntimeError("Downloaded file looks too small or missing.")
+            repack_model(part)
+            # publish last: MODEL_PATH only ever holds a validated, repacked model
+            part.replace(MODEL_PATH)
+        except Exception as e:
+            part.unlink(missing_ok=True)
+            st.error(f"Model download failed: {e}")
+            st.stop()
+
+def repack_model(path: Path):
+    # rewrite once as an uncompressed protocol-5 pickle so load_assets can
+    # memory-map the numpy arrays instead of decompressing them into the heap
+    tmp = path.with_name(path.name + ".tmp")
+    dump(load(path), tmp, compress=0, protocol=5)
+    tmp.replace(path)
+
+def read_json_resilient(path: Path, default):
+    if not path.exists():
+        return default
+    # fast path: orjson straight from the bytes (mmap'd for big files)
+    try:
+        with open(path, "rb") as f:
+            if path.stat().st_size > 1_000_000:
+                # orjson won't take an mmap directly, only a buffer over it
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm, memoryview(mm) as mv:
+                    return orjson.loads(mv)
+            return orjson.loads(f.read())
+    except OSError:
+        return default
+    except orjson.JSONDecodeError:
+        pass
+    # orjson is UTF-8 only; choices.json ships latin-1 encoded
+    try:
+        with open(path, "r", encoding="latin-1") as f:
+            return json.load(f)
+    except Exception:
+        return default
+
+def compile_preprocessor(pre, features):
+    # Replay a fitted ColumnTransformer with plain dict lookups so a single-row
+    # predict never has to build a DataFrame. Returns None for anything we
+    # can't reproduce exactly (the app then goes through the full pipeline).
+    from sklearn.compose import ColumnTransformer
+    from sklearn.preprocessing import OneHotEncoder, OrdinalEncoder
+    if not isinstance(pre, ColumnTransformer):
+        return None
+    plan = {"numeric": [], "onehot": {}, "ordinal": {}, "strict": set()}
+    out = 0
+    for _, trans, cols in pre.transformers_:
+        if trans == "drop":
+            continue
+        if isinstance(cols, str):
+            cols = [cols]
+        cols = [features[c] if isinstance(c, (int, np.integer)) else c for c in cols]
+        if trans == "passthrough":
+            for c in cols:
+                plan["numeric"].append((out, c)); out += 1
+        elif isinstance(trans, OneHotEncoder):
+            if trans.drop_idx_ is not None or getattr(trans, "_infrequent_enabled", False):
+                return None
+            for c, cats in zip(cols, trans.categories_):
+                plan["onehot"][c] = {cat: out + i for i, cat in enumerate(cats)}
+                if trans.handle_unknown == "error":
+                    plan["strict"].add(c)
+                out += len(cats)
+        elif isinstance(trans, OrdinalEncoder):
+            unknown = trans.unknown_value if trans.handle_unknown == "use_encoded_value" else None
+            for c, cats in zip(cols, trans.categories_):
+                plan["ordinal"][c] = (out, {cat: i for i, cat in enumerate(cats)}, unknown)
+                out += 1
+        else:
+            return None
+    plan["n_out"] = out
+    return plan
+
+def sample_rows(plan, features, n=8):
+    # a few rows made of categories the fitted encoder knows plus varied
+    # numerics, used to check the fast path against sklearn at load time
+    cats = {c: list(slots) for c, slots in plan["onehot"].items()}
+    cats.update({c: list(codes) for c, (_, codes, _) in plan["ordinal"].items()})
+    rows = []
+    for i in range(n):
+        row = {}
+        for j, c in enumerate(features):
+            if c in cats:
+                row[c] = cats[c][i * 7 % len(cats[c])] if cats[c] else ""
+            else:
+                row[c] = float((i * 13 + j * 5) % 60)
+        rows.append(row)
+    # plus one row of unseen categories wherever the encoder tolerates them, so
+    # the check also covers the unknown/NaN routing
+    unseen = dict(rows[0])
+    for c in plan["onehot"]:
+        if c not in plan["strict"]:
+            unseen[c] = "<unseen>"
+    for c, (_, _, unknown) in plan["ordinal"].items():
+        if unknown is not None:
+            unseen[c] = "<unseen>"
+    if unseen != rows[0]:
+        rows.append(unseen)
+    return rows
+
+def encode_row(plan, row):
+    # one row in, (1, n_out) float32 array out -- same layout the forest was fit on
+    arr = np.zeros((1, plan["n_out"]), dtype=np.float32)
+    for j, c in plan["numeric"]:
+        arr[0, j] = row[c]
+    for c, slots in plan["onehot"].items():
+        j = slots.get(row[c])
+        if j is not None:
+            arr[0, j] = 1.0
+        elif c in plan["strict"]:
+            raise ValueError(f"Unknown {c}: {row[c]!r}")
+    for c, (j, codes, unknown) in plan["ordinal"].items():
+        code = codes.get(row[c], unknown)
+        if code is None:
+            raise ValueError(f"Unknown {c}: {row[c]!r}")
+        arr[0, j] = code
+    return arr
+
+def make_forest_predict(forest, n_out):
+    # (n, n_out) float32 array -> (n,) predictions. Prefer the compiled
+    # artifacts from convert.py (Treelite library, then ONNX), then the flat-
+    # forest kernel (AOT-built by convert.py, else numba JIT); else sklearn.
+    if TREELITE_LIB_PATH.exists():
+        try:
+            import tl2cgen
+            predictor = tl2cgen.Predictor(str(TREELITE_LIB_PATH), nthread=1, verbose=False)
+            if predictor.num_feature == n_out:
+                return lambda arr: predictor.predict(tl2cgen.DMatrix(arr)).reshape(len(arr), -1)[:, 0]
+            st.warning(f"{TREELITE_LIB_PATH.name} does not match the model; skipping it.")
+        except Exception as e:
+            st.warning(f"Treelite predictor unavailable ({e}); skipping it.")
+    if ONNX_PATH.exists():
+        try:
+            import onnxruntime as ort
+            so = ort.SessionOptions()
+            so.intra_op_num_threads = 1
+            so.inter_op_num_threads = 1
+            so.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+            sess = ort.InferenceSession(str(ONNX_PATH), sess_options=so,
+                                        providers=["CPUExecutionProvider"])
+            inp = sess.get_inputs()[0]
+            if inp.shape[-1] == n_out:
+                return lambda arr: sess.run(None, {inp.name: arr})[0][:, 0]
+            st.warning(f"{ONNX_PATH.name} does not match the model; using sklearn.")
+        except Exception as e:
+            st.warning(f"ONNX Runtime unavailable ({e}); using sklearn.")
+    if hasattr(forest, "estimators_"):
+        try:
+            import forest_kernel
+            try:
+                # native extension from convert.py: no JIT compile in any worker
+                from forest_native import forest_predict as kernel
+            except ImportError:
+                from numba import njit
+                kernel = njit(cache=True, nogil=True)(forest_kernel.forest_predict)
+            soa = forest_kernel.flatten_forest(forest)
+            return lambda arr: kernel(arr, *soa)
+        except ImportError:
+            pass
+    return forest.predict
+
+def start_batcher(forest_predict, max_batch=64, timeout=30.0):
+    # One worker thread per process: rows that concurrent sessions have already
+    # queued are stacked into a single forest call. A lone request never waits
+    # for company -- the worker only drains what is queued right now.
+    q = queue.Queue()
+
+    def worker():
+        while True:
+            items = [q.get()]
+            while len(items) < max_batch:
+                try:
+                    items.append(q.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                preds = forest_predict(np.vstack([arr for arr, _ in items]))
+            except Exception as e:
+                for _, fut in items:
+                    fut.set_exception(e)
+                continue
+            for (_, fut), p in zip(items, preds):
+                fut.set_result(float(p))
+
+    threading.Thread(target=worker, name="predict-batcher", daemon=True).start()
+
+    def predict_batched(arr):
+        fut = Future()
+        q.put((arr, fut))
+        try:
+            return fut.result(timeout=timeout)
+        except FutureTimeout:
+            raise RuntimeError(f"prediction worker did not answer within {timeout:.0f}s") from None
+    return predict_batched
+
+@st.cache_resource(show_spinner=False, ttl=None, max_entries=1)
+def load_assets():
+    features = read_json_resilient(FEATURES_PATH, None)
+    if not features:
+        st.error(f"Missing or invalid {FEATURES_PATH.name}."); st.stop()
+    choices = read_json_resilient(CHOICES_PATH, {"Town": [], "Type": []})
+    # immutable once, so reruns hand the same object to the selectboxes
+    choices["Town"] = tuple(choices.get("Town", []))
+    choices["Type"] = tuple(choices.get("Type", []))
+    # O(1) membership checks before predict (empty set = no list to check against)
+    known_towns = frozenset(choices["Town"])
+    known_types = frozenset(choices["Type"])
+    cat_cols = ["Town", "Type"]
+    num_cols = [c for c in features if c not in cat_cols]
+    model = load(MODEL_PATH, mmap_mode="r")
+
+    # patch for sklearn 1.3 -> 1.7 (monotonic_cst)
+    from sklearn.tree import DecisionTreeRegressor
+    if hasattr(model, "steps"):
+        last = model.steps[-1][1]
+        if hasattr(last, "estimators_"):
+            for est in last.estimators_:
+                if isinstance(est, DecisionTreeRegressor) and not hasattr(est, "monotonic_cst"):
+                    est.monotonic_cst = None
+
+    # unwrap the pipeline once so predict skips Pipeline/ColumnTransformer validation
+    plan = None
+    if hasattr(model, "steps"):
+        pre, forest = model[:-1], model.steps[-1][1]
+        # no joblib workers for a 1-row predict
+        if hasattr(forest, "n_jobs"):
+            forest.n_jobs = 1
+        if len(model.steps) == 2:
+            # anything the compiler trips over (e.g. slice column specs) just
+            # means "can't replay this" -> pipeline path
+            try:
+                plan = compile_preprocessor(model.steps[0][1], features)
+            except Exception:
+                plan = None
+        # the forest only ever sees arrays from here on; drop the names it was
+        # fit with so every predict doesn't warn about missing feature names
+        if hasattr(forest, "feature_names_in_"):
+            del forest.feature_names_in_
+        pre.set_output(transform="default")
+
+        # the hand-replayed encoder must reproduce the pipeline exactly;
+        # otherwise use the DataFrame path below
+        if plan is not None:
+            samples = sample_rows(plan, features)
+            try:
+                X_check = np.vstack([encode_row(plan, r) for r in samples])
+                ok = np.allclose(forest.predict(X_check),
+                                 model.predict(pd.DataFrame.from_records(samples, columns=features)))
+            except Exception:
+                ok = False
+            if not ok:
+                st.warning("Fast input encoding disagrees with the model pipeline; using the pipeline.")
+                plan = None
+
+    if plan is not None:
+        # fast path: encode Town/Type ourselves and call the forest on a raw array
+        forest_predict = make_forest_predict(forest, plan["n_out"])
+        # doubles as warm-up: the chosen backend (Treelite / ONNX / numba kernel,
+        # possibly a stale artifact) must match sklearn, else use forest.predict
+        try:
+            ok = np.allclose(forest_predict(X_check), forest.predict(X_check), rtol=1e-4)
+        except Exception:
+            ok = False
+        if not ok:
+            st.warning("Compiled forest predictor disagrees with sklearn; using sklearn.")
+            forest_predict = forest.predict
+        predict_batched = start_batcher(forest_predict)
+
+        def predict_fn(row):
+            return predict_batched(encode_row(plan, row))
+    else:
+        # DataFrame fallback: fixed dtypes so pandas skips per-row inference
+        dtype_map = {c: "float32" for c in num_cols}
+        dtype_map.update({c: pd.CategoricalDtype(choices[c]) for c in cat_cols
+                          if c in features and choices.get(c)})
+
+        def to_frame(row):
+            return pd.DataFrame.from_records([row], columns=features).astype(dtype_map, copy=False)
+
+        if hasattr(model, "steps"):
+            def predict_fn(row):
+                return float(forest.predict(pre.transform(to_frame(row)))[0])
+        else:
+            def predict_fn(row):
+                return float(model.predict(to_frame(row))[0])
+
+    # identical resubmits (same inputs, same order as features) skip the model
+    predict_uncached = predict_fn
+
+    @lru_cache(maxsize=4096)
+    def predict_cached(key):
+        return predict_uncached(dict(zip(features, key)))
+
+    def predict_fn(row):
+        return predict_cached(tuple(row[k] for k in features))
+
+    # release the garbage left over from unpickling / the repack
+    gc.collect()
+    return model, features, choices, cat_cols, num_cols, known_towns, known_types, predict_fn